@@ -1,21 +1,30 @@
 """
 Bootstraps environment variables and secrets into os.environ.
 This module MUST be imported first in any Lambda handler to ensure proper configuration.
+Secrets are loaded lazily via ensure_secrets_loaded() so warm-up pings never pay for them.
 """
 
 import os
+from functools import lru_cache
+
 import boto3
 from botocore.exceptions import ClientError
 
 # Determine the AWS region (default to us-east-1)
 AWS_REGION = os.environ.get("AWS_REGION", "us-east-1")
-secrets_client = boto3.client("secretsmanager", region_name=AWS_REGION)
 
 
+@lru_cache(maxsize=None)
+def get_secrets_client():
+    """Build the Secrets Manager client once, and only when a secret is fetched."""
+    return boto3.client("secretsmanager", region_name=AWS_REGION)
+
+
+@lru_cache(maxsize=None)
 def get_secret(secret_name: str) -> str:
-    """Retrieve a secret string from AWS Secrets Manager."""
+    """Retrieve a secret string from AWS Secrets Manager (cached per container)."""
     try:
-        response = secrets_client.get_secret_value(SecretId=secret_name)
+        response = get_secrets_client().get_secret_value(SecretId=secret_name)
         return response.get("SecretString", "")
     except ClientError as e:
         raise RuntimeError(
@@ -32,11 +41,23 @@ secrets_map = {
     "INTELLIGENCE_API_SECRET": "INTELLIGENCE_API_SECRET",
 }
 
-# Load secrets into os.environ, overwriting any existing values
-for env_var, secret_name in secrets_map.items():
-    secret_value = get_secret(secret_name)
-    if secret_value:  # Only set if the secret was retrieved
-        os.environ[env_var] = secret_value
+_loaded = False
+
+
+def ensure_secrets_loaded() -> None:
+    """Load secrets into os.environ on first use, skipping any already present."""
+    global _loaded
+    if _loaded:
+        return
+
+    for env_var, secret_name in secrets_map.items():
+        if os.environ.get(env_var):
+            continue
+        secret_value = get_secret(secret_name)
+        if secret_value:  # Only set if the secret was retrieved
+            os.environ[env_var] = secret_value
+
+    _loaded = True
 
 
 # Apply default values for common Datadog config
@@ -1,16 +1,45 @@
 import asyncio
+import atexit
+import logging
 from typing import Dict, Any, Set
 from boto3.dynamodb.types import TypeDeserializer
 
 import config
 from logger_setup import get_logger
-from handlers.dynamo_event_handler import notify_reply_service
+from handlers.dynamo_event_handler import (
+    close_http_client,
+    get_active_sessions,
+    notify_reply_service,
+)
 
 logger = get_logger("dynamo")
+_DEBUG = logger.is_enabled_for(logging.DEBUG)
 deserializer = TypeDeserializer()
 
+# Persist one event loop across warm invocations so the pooled HTTP client
+# keeps its keep-alive connections instead of being bound to a closed loop
+_LOOP = asyncio.new_event_loop()
+asyncio.set_event_loop(_LOOP)
+
+
+def _shutdown() -> None:
+    try:
+        _LOOP.run_until_complete(close_http_client())
+    except Exception as e:
+        logger.warning("Failed to close HTTP client", error=str(e))
+    finally:
+        _LOOP.close()
+
+
+atexit.register(_shutdown)
+
 
 def dynamo_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    # Load secrets once per container, outside the catch-all below: a failure
+    # must fail the invocation so the stream retries the batch
+    if event.get("source") != "aws.events":
+        config.ensure_secrets_loaded()
+
     try:
         if event.get("source") == "aws.events":
             logger.info("Received warm-up event from CloudWatch")
@@ -39,9 +68,10 @@ def dynamo_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                     # Only process inbound messages
                     chat_type = unmarshalled.get("chat_type")
                     if chat_type != "inbound":
-                        logger.debug(
-                            f"Skipping non-inbound message: chat_type={chat_type}"
-                        )
+                        if _DEBUG:
+                            logger.debug(
+                                "Skipping non-inbound message", chat_type=chat_type
+                            )
                         continue
 
                     sender_id = unmarshalled.get("sender_id")
@@ -55,15 +85,19 @@ def dynamo_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         # Fire off all notify calls in parallel only if there are sender_ids
         if sender_ids:
             logger.info(f"Notifying reply service for {len(sender_ids)} sender(s)")
-            # Create a new event loop for Lambda compatibility
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                loop.run_until_complete(
-                    asyncio.gather(*[notify_reply_service(sid) for sid in sender_ids])
+            sessions = get_active_sessions(sender_ids)
+            notify_ids = list(sender_ids)
+            results = _LOOP.run_until_complete(
+                asyncio.gather(
+                    *[notify_reply_service(sid, sessions.get(sid)) for sid in notify_ids],
+                    return_exceptions=True,
                 )
-            finally:
-                loop.close()
+            )
+            for sender_id, result in zip(notify_ids, results):
+                if isinstance(result, BaseException):
+                    logger.error(
+                        "Notify task failed", sender_id=sender_id, error=str(result)
+                    )
         else:
             logger.info("No sender_ids to notify")
 
@@ -1,64 +1,167 @@
 import os
+import time
+import aiohttp
 import boto3
-import httpx
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from logger_setup import get_logger
 from datetime import datetime
-import config  # Ensure secrets are loaded into environment
+from handlers.session_store import resolve_active_session
+from typing import Any, Dict, Iterable, Optional
 
 logger = get_logger("reply")
 
-dynamodb = boto3.resource("dynamodb")
+SESSION_LOOKUP_WORKERS = 16
+
+# Connection pool sized to the session lookup threads (botocore defaults to 10)
+dynamodb = boto3.resource(
+    "dynamodb", config=Config(max_pool_connections=SESSION_LOOKUP_WORKERS)
+)
 session_table = dynamodb.Table("sessions")
 
+# Split timeout budget so a slow connect/TLS handshake can't eat the whole request
+REPLY_HTTP_TIMEOUT = aiohttp.ClientTimeout(
+    total=float(os.environ.get("REPLY_HTTP_TIMEOUT_TOTAL", "10")),
+    connect=float(os.environ.get("REPLY_HTTP_TIMEOUT_CONNECT", "3")),
+    sock_read=float(os.environ.get("REPLY_HTTP_TIMEOUT_READ", "10")),
+)
 
-async def notify_reply_service(sender_id: str) -> None:
-    url = "https://intelligence.theuncproject.com/reply/"
-    payload = {"sender_id": sender_id, "message": f"Hello, world! {sender_id}"}
-    headers = {
-        "x-intelligence-api-secret": os.environ.get("INTELLIGENCE_API_SECRET", "")
-    }
+# Shared across warm invocations so keep-alive connections and TLS sessions are
+# reused; created lazily because aiohttp sessions must be built inside the loop
+_http_session = None
 
-    try:
-        user_session = session_table.query(
-            IndexName="SenderSessionsIndex",
-            KeyConditionExpression="sender_id = :sid",
-            FilterExpression="#status = :status",
-            ExpressionAttributeNames={"#status": "status"},
-            ExpressionAttributeValues={":sid": sender_id, ":status": "active"},
-            Limit=1,
-            ScanIndexForward=False,  # Latest first
-        )
 
-        if user_session.get("Items") and len(user_session["Items"]) > 0:
-            user_session_is_limited = user_session["Items"][0].get("user_limited_until")
+def _get_http_session() -> aiohttp.ClientSession:
+    """Return the shared HTTP session, creating it on first use."""
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        _http_session = aiohttp.ClientSession(
+            timeout=REPLY_HTTP_TIMEOUT,
+            # Expire idle connections well before typical server idle timeouts;
+            # the age check on reuse also discards connections left open while
+            # the container was frozen, so a POST is not sent on a dead socket
+            connector=aiohttp.TCPConnector(limit=64, keepalive_timeout=5),
+        )
+    return _http_session
 
-            if user_session_is_limited:
-                user_session_is_limited = datetime.fromisoformat(
-                    user_session_is_limited
-                )
-                if user_session_is_limited > datetime.now():
-                    logger.info(
-                        f"User {sender_id} is rate limited until {user_session_is_limited}"
-                    )
-                    return
 
-    except Exception as e:
-        logger.error("Failed to get user session", sender_id=sender_id, error=str(e))
-        # Don't return here - allow the service to continue even if session check fails
+async def close_http_client() -> None:
+    """Close the shared HTTP session when the container shuts down."""
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
 
-    try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            response = await client.post(url, json=payload, headers=headers)
 
-        if response.status_code == 200:
+async def _post_reply(
+    sender_id: str, url: str, payload: dict, headers: dict
+) -> None:
+    async with _get_http_session().post(url, json=payload, headers=headers) as response:
+        if response.status == 200:
             logger.info("Successfully notified reply service", sender_id=sender_id)
         else:
+            response_body = await response.read()
             logger.warning(
                 "Reply service returned non-200",
                 sender_id=sender_id,
-                status_code=response.status_code,
-                response_body=response.text,
+                status_code=response.status,
+                response_body=response_body.decode(errors="replace"),
             )
+
+
+def _to_epoch(value: Any) -> Optional[int]:
+    """Normalize user_limited_until to epoch seconds, accepting legacy ISO strings."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        return int(datetime.fromisoformat(value).timestamp())
+    return int(value)
+
+
+def get_active_session(sender_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the sender's latest active session.
+
+    Args:
+        sender_id: The ID of the sender
+
+    Returns:
+        Dict with session_id and user_limited_until (epoch seconds), or None
+        if the sender has no active session
+    """
+    item = resolve_active_session(session_table, sender_id)
+    if item is None:
+        return None
+
+    return {
+        "session_id": item["session_id"],
+        "user_limited_until": _to_epoch(item.get("user_limited_until")),
+    }
+
+
+def get_active_sessions(sender_ids: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Look up the active session of many senders in parallel.
+
+    The indexes are keyed by sender_id rather than the table's primary key, so
+    this runs one Query per sender on a thread pool instead of BatchGetItem.
+
+    Args:
+        sender_ids: The IDs of the senders
+
+    Returns:
+        Dict mapping sender IDs to session info; None when the sender has no
+        active session or the lookup failed
+    """
+    sender_ids = list(sender_ids)
+    sessions = {}
+    if not sender_ids:
+        return sessions
+
+    with ThreadPoolExecutor(
+        max_workers=min(SESSION_LOOKUP_WORKERS, len(sender_ids))
+    ) as executor:
+        futures = {
+            executor.submit(get_active_session, sender_id): sender_id
+            for sender_id in sender_ids
+        }
+        for future in as_completed(futures):
+            sender_id = futures[future]
+            try:
+                sessions[sender_id] = future.result()
+            except Exception as e:
+                # Allow the notify to go ahead even if the session check fails
+                logger.error(
+                    "Failed to get user session", sender_id=sender_id, error=str(e)
+                )
+                sessions[sender_id] = None
+
+    return sessions
+
+
+async def notify_reply_service(
+    sender_id: str, session_info: Optional[Dict[str, Any]] = None
+) -> None:
+    url = "https://intelligence.theuncproject.com/reply/"
+    payload = {"sender_id": sender_id, "message": f"Hello, world! {sender_id}"}
+    headers = {
+        "x-intelligence-api-secret": os.environ.get("INTELLIGENCE_API_SECRET", "")
+    }
+
+    if session_info is not None:
+        user_session_is_limited = session_info["user_limited_until"]
+        if user_session_is_limited and user_session_is_limited > int(time.time()):
+            logger.info(
+                f"User {sender_id} is rate limited until {user_session_is_limited}"
+            )
+            return
+
+    try:
+        try:
+            await _post_reply(sender_id, url, payload, headers)
+        except aiohttp.ConnectionTimeoutError:
+            # The request never reached the server, so retrying the POST can't
+            # send a duplicate reply; retry once immediately
+            logger.warning("Reply service connect timed out, retrying", sender_id=sender_id)
+            await _post_reply(sender_id, url, payload, headers)
     except Exception as e:
         logger.error(
             "Failed to notify reply service", sender_id=sender_id, error=str(e)
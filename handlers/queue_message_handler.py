@@ -3,103 +3,199 @@ Message processor for handling batched messages from SQS.
 """
 
 import boto3
+import os
+import random
 import time
 import uuid
+from boto3.dynamodb.types import TypeSerializer
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from handlers.session_store import remember_active_session, resolve_active_session
 from logger_setup import get_logger
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Set
 
 logger = get_logger("message_processor")
 
-dynamodb = boto3.resource("dynamodb")
+# An SQS FIFO batch holds at most 10 messages, so a batch has at most 10
+# senders and, even with DDB_BATCH_WRITE_SIZE=1, at most 10 chunks to write
+SESSION_LOOKUP_WORKERS = 10
+BATCH_WRITE_WORKERS = 10
+MAX_BATCH_WRITE_ATTEMPTS = 6
+
+# Connection pools sized to the thread pools using them (botocore defaults to 10)
+dynamodb = boto3.resource(
+    "dynamodb", config=Config(max_pool_connections=SESSION_LOOKUP_WORKERS)
+)
 session_table = dynamodb.Table("sessions")
-chat_table = dynamodb.Table("chats")
 
+# Chats are written through the low-level client with pre-serialized items,
+# skipping the resource layer on the batch write hot path
+CHAT_TABLE_NAME = "chats"
+ddb_client = boto3.client(
+    "dynamodb", config=Config(max_pool_connections=BATCH_WRITE_WORKERS)
+)
+serializer = TypeSerializer()
+
+# Items per BatchWriteItem call: 25 for DynamoDB, up to 100 for Alternator
+BATCH_WRITE_SIZE = int(os.environ.get("DDB_BATCH_WRITE_SIZE", "25"))
+if not 1 <= BATCH_WRITE_SIZE <= 100:
+    raise ValueError(
+        f"DDB_BATCH_WRITE_SIZE must be between 1 and 100, got {BATCH_WRITE_SIZE}"
+    )
 
-def store_chat_messages(
+
+def build_chat_items(
     session_id: str, sender_id: str, messages: List[Dict[str, Any]]
-) -> None:
+) -> List[Dict[str, Any]]:
     """
-    Store chat messages in DynamoDB using batch writes in chunks of 25 messages.
+    Build BatchWriteItem PutRequests for a sender's messages.
 
     Args:
         session_id: The ID of the session
         sender_id: The ID of the sender
         messages: List of parsed messages to store
+
+    Returns:
+        List of PutRequest entries for the chats table, in low-level
+        DynamoDB attribute-value format, with at most one item per message_id
+
+    Raises:
+        ValueError: If the sender or any message is missing its key field.
+            Chunks are shared across senders, so an invalid key must fail
+            this sender here rather than the whole BatchWriteItem call.
     """
-    try:
-        timestamp = int(time.time())
-
-        # Process messages in chunks of 25 (DynamoDB batch write limit)
-        for i in range(0, len(messages), 25):
-            chunk = messages[i : i + 25]
-            batch_items = []
-
-            for message in chunk:
-                parsed_body = message["body"]  # Already parsed in consumer
-                content = parsed_body["content"]
-
-                # Prepare content data including both text and media
-                message_content = {
-                    "text": content["text"],
-                    "media_count": content["media_count"],
-                    "segments": content["segments"],
-                }
-
-                # Add media items if present
-                if content.get("media_items"):
-                    message_content["media_items"] = content["media_items"]
-
-                # Create PutRequest item
-                batch_items.append(
-                    {
-                        "PutRequest": {
-                            "Item": {
-                                "sender_id": sender_id,
-                                "chat_type": "inbound",
-                                "session_id": session_id,
-                                "message_id": parsed_body["metadata"]["message_id"],
-                                "content": message_content,
-                                "sender_info": parsed_body["sender"],
-                                "metadata": parsed_body["metadata"],
-                                "created_at": timestamp,
-                            }
-                        }
-                    }
-                )
-
-            if batch_items:
-                # Execute batch write for the current chunk
-                response = chat_table.meta.client.batch_write_item(
-                    RequestItems={chat_table.name: batch_items}
-                )
-
-                # Handle unprocessed items if any
-                unprocessed = response.get("UnprocessedItems", {}).get(
-                    chat_table.name, []
-                )
-                if unprocessed:
-                    logger.warning(
-                        "Some items were not processed",
-                        unprocessed_count=len(unprocessed),
-                        sender_id=sender_id,
-                        chunk_size=len(chunk),
-                    )
-
-        logger.info(
-            "Stored chat messages",
-            message_count=len(messages),
-            session_id=session_id,
+    if not sender_id:
+        raise ValueError("Messages have no sender_id")
+
+    # Fields shared by every item for this sender; serialized once, copied per message
+    base_item = {
+        "sender_id": serializer.serialize(sender_id),
+        "chat_type": serializer.serialize("inbound"),
+        "session_id": serializer.serialize(session_id),
+        "created_at": serializer.serialize(int(time.time())),
+    }
+    # Keyed by message_id: BatchWriteItem rejects a request containing duplicate keys
+    items_by_message_id = {}
+
+    for message in messages:
+        parsed_body = message["body"]  # Already parsed in consumer
+        content = parsed_body["content"]
+        metadata = parsed_body["metadata"]
+        if not metadata.get("message_id"):
+            raise ValueError(f"Message from sender {sender_id} has no message_id")
+
+        item = base_item.copy()
+        item["message_id"] = serializer.serialize(metadata["message_id"])
+        item["content"] = {
+            "text": content["text"],
+            "media_count": content["media_count"],
+            "segments": content["segments"],
+        }
+        # Add media items if present
+        if content.get("media_items"):
+            item["content"]["media_items"] = content["media_items"]
+        item["content"] = serializer.serialize(item["content"])
+        item["sender_info"] = serializer.serialize(parsed_body["sender"])
+        item["metadata"] = serializer.serialize(metadata)
+
+        items_by_message_id[metadata["message_id"]] = {"PutRequest": {"Item": item}}
+
+    if len(items_by_message_id) < len(messages):
+        logger.warning(
+            "Dropped duplicate messages",
             sender_id=sender_id,
+            duplicate_count=len(messages) - len(items_by_message_id),
         )
 
-    except Exception as e:
-        logger.error(
-            "Error storing chat messages",
-            error=e,
-            session_id=session_id,
-            sender_id=sender_id,
+    return list(items_by_message_id.values())
+
+
+def write_chat_batch(batch_items: List[Dict[str, Any]]) -> None:
+    """
+    Execute one BatchWriteItem call, re-submitting unprocessed items with
+    jittered exponential backoff.
+
+    Args:
+        batch_items: Up to BATCH_WRITE_SIZE PutRequest entries
+
+    Raises:
+        RuntimeError: If items are still unprocessed after the final attempt
+    """
+    request_items = {CHAT_TABLE_NAME: batch_items}
+
+    for attempt in range(MAX_BATCH_WRITE_ATTEMPTS):
+        if attempt:
+            time.sleep(min(2**attempt * 0.05 + random.random() * 0.05, 2.0))
+
+        response = ddb_client.batch_write_item(RequestItems=request_items)
+        request_items = response.get("UnprocessedItems") or {}
+        if not request_items:
+            return
+
+        logger.warning(
+            "Some items were not processed, retrying",
+            unprocessed_count=len(request_items.get(CHAT_TABLE_NAME, [])),
+            chunk_size=len(batch_items),
+            attempt=attempt + 1,
         )
-        raise
+
+    raise RuntimeError(
+        f"{len(request_items.get(CHAT_TABLE_NAME, []))} chat items still unprocessed "
+        f"after {MAX_BATCH_WRITE_ATTEMPTS} attempts"
+    )
+
+
+def store_chat_messages(batch_items: List[Dict[str, Any]]) -> Set[str]:
+    """
+    Store chat items in DynamoDB using batch writes in chunks of
+    BATCH_WRITE_SIZE items. Items from different senders are packed into the
+    same chunk; a single chunk is written inline, several concurrently.
+
+    Args:
+        batch_items: PutRequest entries for the chats table
+
+    Returns:
+        IDs of senders with at least one item in a failed chunk
+    """
+    failed_senders = set()
+
+    # Split items into chunks (25 is the DynamoDB batch write limit)
+    chunks = [
+        batch_items[i : i + BATCH_WRITE_SIZE]
+        for i in range(0, len(batch_items), BATCH_WRITE_SIZE)
+    ]
+    if not chunks:
+        return failed_senders
+
+    # The usual case with the default chunk size: no thread pool needed
+    if len(chunks) == 1:
+        try:
+            write_chat_batch(chunks[0])
+        except Exception as e:
+            failed_senders.update(_failed_chunk_senders(chunks[0], e))
+        return failed_senders
+
+    with ThreadPoolExecutor(max_workers=min(BATCH_WRITE_WORKERS, len(chunks))) as executor:
+        futures = {executor.submit(write_chat_batch, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                failed_senders.update(_failed_chunk_senders(futures[future], e))
+
+    return failed_senders
+
+
+def _failed_chunk_senders(chunk: List[Dict[str, Any]], error: Exception) -> Set[str]:
+    """Log a chunk that could not be written and return its sender IDs."""
+    chunk_senders = {item["PutRequest"]["Item"]["sender_id"]["S"] for item in chunk}
+    logger.error(
+        "Error storing chat messages",
+        error=error,
+        chunk_size=len(chunk),
+        sender_ids=sorted(chunk_senders),
+    )
+    return chunk_senders
 
 
 def get_or_create_session(sender_id: str) -> str:
@@ -114,30 +210,28 @@ def get_or_create_session(sender_id: str) -> str:
     """
     try:
         # Check for existing active session
-        response = session_table.query(
-            IndexName="SenderSessionsIndex",
-            KeyConditionExpression="sender_id = :sid",
-            FilterExpression="#status = :status",
-            ExpressionAttributeNames={"#status": "status"},
-            ExpressionAttributeValues={":sid": sender_id, ":status": "active"},
-            Limit=1,
-            ScanIndexForward=False,  # Latest first
-        )
+        session = resolve_active_session(session_table, sender_id)
 
-        if response["Items"]:
-            return response["Items"][0]["session_id"]
+        if session is not None:
+            return session["session_id"]
 
         session_id = str(uuid.uuid4())
+        created_at = int(time.time())
 
         session_table.put_item(
             Item={
                 "session_id": session_id,
                 "sender_id": sender_id,
                 "status": "active",
-                "created_at": int(time.time()),
+                "created_at": created_at,
+                # Sort key of SenderStatusIndex, the only index session lookups read
+                "status_created_at": f"active#{created_at}",
             }
         )
 
+        # The index may not show the new session yet; the cache covers the gap
+        remember_active_session(sender_id, session_id)
+
         logger.info("Created new session", session_id=session_id, sender_id=sender_id)
 
         return session_id
@@ -147,17 +241,69 @@ def get_or_create_session(sender_id: str) -> str:
         raise
 
 
-def process_message(sender_id: str, messages: List[Dict[str, Any]]) -> None:
+def resolve_sessions(sender_ids: List[str]) -> Dict[str, str]:
     """
-    Process a batch of messages for a sender.
+    Get or create the active session for many senders in parallel.
 
     Args:
-        sender_id: The ID of the sender
-        messages: List of parsed messages to process
+        sender_ids: The IDs of the senders
+
+    Returns:
+        Dict mapping sender IDs to session IDs; senders whose lookup failed
+        are omitted
     """
-    try:
-        session_id = get_or_create_session(sender_id)
-        store_chat_messages(session_id, sender_id, messages)
-    except Exception as e:
-        logger.error("Error processing messages", error=e, sender_id=sender_id)
-        raise
+    sessions = {}
+    if not sender_ids:
+        return sessions
+
+    with ThreadPoolExecutor(
+        max_workers=min(SESSION_LOOKUP_WORKERS, len(sender_ids))
+    ) as executor:
+        futures = {
+            executor.submit(get_or_create_session, sender_id): sender_id
+            for sender_id in sender_ids
+        }
+        for future in as_completed(futures):
+            sender_id = futures[future]
+            try:
+                sessions[sender_id] = future.result()
+            except Exception as e:
+                logger.error("Failed to resolve session", error=e, sender_id=sender_id)
+
+    return sessions
+
+
+def process_messages(messages_by_sender: Dict[str, List[Dict[str, Any]]]) -> Set[str]:
+    """
+    Resolve sessions for all senders, then store every message using shared
+    batch writes.
+
+    Args:
+        messages_by_sender: Dict mapping sender IDs to their parsed messages
+
+    Returns:
+        IDs of senders whose messages could not all be stored
+    """
+    sessions = resolve_sessions(list(messages_by_sender))
+    failed_senders = set(messages_by_sender) - set(sessions)
+
+    batch_items = []
+    for sender_id, messages in messages_by_sender.items():
+        session_id = sessions.get(sender_id)
+        if session_id is None:
+            continue  # Failure already logged by resolve_sessions
+        try:
+            batch_items.extend(build_chat_items(session_id, sender_id, messages))
+        except Exception as e:
+            failed_senders.add(sender_id)
+            logger.error("Error building chat items", error=e, sender_id=sender_id)
+
+    failed_senders |= store_chat_messages(batch_items)
+
+    logger.info(
+        "Stored chat messages",
+        message_count=len(batch_items),
+        sender_count=len(sessions),
+        failed_sender_count=len(failed_senders),
+    )
+    return failed_senders
@@ -0,0 +1,140 @@
+"""
+Active session lookup shared by the queue and DynamoDB stream handlers.
+"""
+
+import threading
+from botocore.exceptions import ClientError
+from cachetools import TTLCache
+from logger_setup import get_logger
+from typing import Any, Dict, Optional
+
+logger = get_logger("session_store")
+
+# sender_id -> session_id of the sender's latest active session, per warm
+# container. Only the id is trusted: every hit is re-read by primary key
+_session_cache = TTLCache(maxsize=10_000, ttl=60)
+_session_cache_lock = threading.Lock()
+
+
+def build_status_created_at(item: Dict[str, Any]) -> str:
+    """Build the SenderStatusIndex sort key for a session item."""
+    return f"{item['status']}#{int(item['created_at'])}"
+
+
+def repair_status_created_at(session_table: Any, item: Dict[str, Any]) -> bool:
+    """
+    Rewrite status_created_at from the item's status and created_at as read.
+
+    Returns:
+        True if the item was updated
+    """
+    try:
+        # Only if the session still exists with the status we read; otherwise the
+        # update would recreate a deleted item or write a stale key
+        session_table.update_item(
+            Key={"session_id": item["session_id"]},
+            UpdateExpression="SET status_created_at = :sca",
+            ConditionExpression="attribute_exists(session_id) AND #status = :status",
+            ExpressionAttributeNames={"#status": "status"},
+            ExpressionAttributeValues={
+                ":sca": build_status_created_at(item),
+                ":status": item["status"],
+            },
+        )
+        return True
+    except Exception as e:
+        if (
+            isinstance(e, ClientError)
+            and e.response["Error"]["Code"] == "ConditionalCheckFailedException"
+        ):
+            return False  # Session changed since it was read; its writer owns the key
+        logger.warning(
+            "Failed to repair status_created_at",
+            session_id=item["session_id"],
+            error=str(e),
+        )
+        return False
+
+
+def find_active_session(session_table: Any, sender_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Find the sender's latest active session via SenderStatusIndex.
+
+    Existing sessions are backfilled by scripts/backfill_status_created_at.py
+    when the index is added. A hit whose status was changed elsewhere without
+    updating status_created_at is treated as no active session, and its key is
+    repaired so it stops matching.
+
+    Args:
+        session_table: The sessions table resource
+        sender_id: The ID of the sender
+
+    Returns:
+        The session item, or None if the sender has no active session
+    """
+    response = session_table.query(
+        IndexName="SenderStatusIndex",
+        KeyConditionExpression=(
+            "sender_id = :sid AND begins_with(status_created_at, :prefix)"
+        ),
+        ExpressionAttributeValues={":sid": sender_id, ":prefix": "active#"},
+        Limit=1,
+        ScanIndexForward=False,  # Latest first
+    )
+
+    items = response.get("Items")
+    if not items:
+        return None
+
+    if items[0].get("status") != "active":
+        repair_status_created_at(session_table, items[0])
+        return None
+
+    return items[0]
+
+
+def remember_active_session(sender_id: str, session_id: str) -> None:
+    """Cache a session just created for the sender as its active session."""
+    with _session_cache_lock:
+        _session_cache[sender_id] = session_id
+
+
+def resolve_active_session(session_table: Any, sender_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the sender's active session, using the per-container cache.
+
+    A cached session_id is re-read with a strongly consistent GetItem and used
+    only while that session is still active, so status and user_limited_until
+    are always current. The remaining staleness is bounded by the cache TTL: a
+    hit keeps returning its session even if a newer active session was created
+    for the sender in another container. Misses query SenderStatusIndex, which
+    is eventually consistent, so a session created moments ago elsewhere may
+    not be found yet.
+
+    Args:
+        session_table: The sessions table resource
+        sender_id: The ID of the sender
+
+    Returns:
+        The session item (at least session_id, status and user_limited_until),
+        or None if the sender has no active session
+    """
+    with _session_cache_lock:
+        session_id = _session_cache.get(sender_id)
+
+    if session_id is not None:
+        item = session_table.get_item(
+            Key={"session_id": session_id},
+            ConsistentRead=True,
+            ProjectionExpression="session_id, #status, user_limited_until",
+            ExpressionAttributeNames={"#status": "status"},
+        ).get("Item")
+        if item and item.get("status") == "active":
+            return item
+        with _session_cache_lock:
+            _session_cache.pop(sender_id, None)
+
+    item = find_active_session(session_table, sender_id)
+    if item is not None:
+        remember_active_session(sender_id, item["session_id"])
+    return item
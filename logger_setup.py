@@ -40,6 +40,10 @@ class Logger:
         """Log debug level message."""
         self.logger.debug(self._format_log(message, **kwargs))
 
+    def is_enabled_for(self, level: int) -> bool:
+        """Check whether messages at the given level would be emitted."""
+        return self.logger.isEnabledFor(level)
+
 
 def get_logger(name: str) -> Logger:
     """Get a configured logger instance."""
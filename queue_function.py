@@ -3,13 +3,19 @@ AWS Lambda queue function that processes messages from SQS.
 """
 
 import config  # Import config for environment variables
-import json
-from urllib.parse import parse_qs
+import logging
+import orjson
+from collections import defaultdict
+from urllib.parse import parse_qsl
 from logger_setup import get_logger
-from typing import Dict, Any, List
-from handlers.queue_message_handler import process_message
+from typing import Dict, Any, List, Tuple
+from handlers.queue_message_handler import process_messages
 
 logger = get_logger("queue")
+_DEBUG = logger.is_enabled_for(logging.DEBUG)
+
+_MEDIA_URL_KEY = "MediaUrl{}".format
+_MEDIA_CONTENT_TYPE_KEY = "MediaContentType{}".format
 
 def parse_message_body(body: str) -> Dict[str, Any]:
     """
@@ -22,40 +28,35 @@ def parse_message_body(body: str) -> Dict[str, Any]:
         Parsed message data as dictionary
     """
     try:
-        # Parse URL-encoded string to dict
-        parsed = parse_qs(body)
-        logger.debug("Parsed message body", parsed_data=parsed)
-
-        # Convert single-item lists to scalar values
-        data = {k: v[0] if len(v) == 1 else v for k, v in parsed.items()}
-
-        # Parse channel metadata if present
-        if "ChannelMetadata" in data:
+        # Parse URL-encoded string to a flat dict in a single pass
+        data = dict(parse_qsl(body, keep_blank_values=True))
+        if _DEBUG:
+            logger.debug("Parsed message body", field_count=len(data))
+
+        # Parse channel metadata if present; a blank value counts as absent
+        if not data.get("ChannelMetadata"):
+            data.pop("ChannelMetadata", None)
+        else:
             try:
-                data["ChannelMetadata"] = json.loads(data["ChannelMetadata"])
-                logger.debug(
-                    "Parsed channel metadata", metadata=data["ChannelMetadata"]
-                )
-            except json.JSONDecodeError as e:
+                data["ChannelMetadata"] = orjson.loads(data["ChannelMetadata"])
+                if _DEBUG:
+                    logger.debug("Parsed channel metadata")
+            except orjson.JSONDecodeError as e:
                 logger.warning(
                     "Failed to parse ChannelMetadata",
                     error=str(e),
                     metadata=data["ChannelMetadata"],
                 )
 
-        # Initialize media list
-        media_items = []
-        media_count = int(data.get("NumMedia", 0))
-
-        # If media is present, collect all media items
-        for i in range(media_count):
-            media_items.append(
-                {
-                    "url": data.get(f"MediaUrl{i}"),
-                    "content_type": data.get(f"MediaContentType{i}"),
-                }
-            )
-            logger.debug(f"Added media item {i}", media_item=media_items[-1])
+        # Collect all media items, if present
+        media_count = int(data.get("NumMedia") or 0)
+        media_items = [
+            {
+                "url": data.get(_MEDIA_URL_KEY(i)),
+                "content_type": data.get(_MEDIA_CONTENT_TYPE_KEY(i)),
+            }
+            for i in range(media_count)
+        ]
 
         parsed_data = {
             "message_type": data.get("MessageType", "unknown"),
@@ -69,7 +70,7 @@ def parse_message_body(body: str) -> Dict[str, Any]:
                 "text": data.get("Body", ""),
                 "media_count": media_count,
                 "media_items": media_items,
-                "segments": int(data.get("NumSegments", 1)),
+                "segments": int(data.get("NumSegments") or 1),
             },
             "metadata": {
                 "message_id": data.get("MessageSid"),
@@ -77,9 +78,12 @@ def parse_message_body(body: str) -> Dict[str, Any]:
                 "status": data.get("SmsStatus"),
                 "channel_data": data.get("ChannelMetadata", {}),
             },
-            "raw": data,  # Keep original data for reference
         }
-        logger.debug("Successfully parsed message", parsed_data=parsed_data)
+        if _DEBUG:
+            logger.debug(
+                "Successfully parsed message",
+                message_id=parsed_data["metadata"]["message_id"],
+            )
         return parsed_data
 
     except Exception as e:
@@ -89,7 +93,7 @@ def parse_message_body(body: str) -> Dict[str, Any]:
 
 def group_messages_by_sender(
     records: List[Dict[str, Any]],
-) -> Dict[str, List[Dict[str, Any]]]:
+) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str]]:
     """
     Group messages by sender ID and parse message bodies.
 
@@ -97,9 +101,11 @@ def group_messages_by_sender(
         records: Raw SQS records
 
     Returns:
-        Dict mapping sender IDs to their parsed messages
+        Tuple of a dict mapping sender IDs to their parsed messages, and the
+        SQS message IDs of records that could not be parsed
     """
-    messages_by_sender = {}
+    messages_by_sender = defaultdict(list)
+    failed_record_ids = []
     logger.info("Starting to group messages", record_count=len(records))
 
     for record in records:
@@ -108,21 +114,19 @@ def group_messages_by_sender(
             parsed_body = parse_message_body(record["body"])
             sender_id = parsed_body["sender"]["id"]
 
-            if sender_id not in messages_by_sender:
-                messages_by_sender[sender_id] = []
-                logger.debug("Created new sender group", sender_id=sender_id)
-
             messages_by_sender[sender_id].append(
                 {
                     "message_id": parsed_body["metadata"]["message_id"],
+                    "record_id": record["messageId"],
                     "body": parsed_body,
                 }
             )
-            logger.debug(
-                "Added message to sender group",
-                sender_id=sender_id,
-                message_id=parsed_body["metadata"]["message_id"],
-            )
+            if _DEBUG:
+                logger.debug(
+                    "Added message to sender group",
+                    sender_id=sender_id,
+                    message_id=parsed_body["metadata"]["message_id"],
+                )
 
         except Exception as e:
             logger.error(
@@ -131,14 +135,17 @@ def group_messages_by_sender(
                 message_id=record.get("messageId", "UNKNOWN"),
                 record=record,
             )
+            # Report it so SQS redelivers it and eventually moves it to the DLQ
+            failed_record_ids.append(record["messageId"])
             continue
 
     logger.info(
         "Finished grouping messages",
         sender_count=len(messages_by_sender),
         total_messages=sum(len(msgs) for msgs in messages_by_sender.values()),
+        failed_count=len(failed_record_ids),
     )
-    return messages_by_sender
+    return dict(messages_by_sender), failed_record_ids
 
 
 def queue_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
@@ -151,7 +158,8 @@ def queue_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         context: The context object that contains information about the runtime
 
     Returns:
-        Dict containing the processing results
+        Dict containing the processing results, including the SQS
+        batchItemFailures for records that should be redelivered
     """
     try:
         logger.info("Starting queue handler", request_id=context.aws_request_id)
@@ -171,44 +179,39 @@ def queue_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         logger.info("Processing batch of messages", message_count=len(records))
 
         # Group and parse messages by sender
-        messages_by_sender = group_messages_by_sender(records)
-
-        # Process each sender's messages
-        for sender_id, messages in messages_by_sender.items():
-            try:
-                logger.info(
-                    "Processing messages for sender",
-                    sender_id=sender_id,
-                    message_count=len(messages),
-                )
-                process_message(sender_id, messages)
-                logger.info(
-                    "Successfully processed messages for sender",
-                    sender_id=sender_id,
-                    message_count=len(messages),
-                )
-            except Exception as e:
-                logger.error(
-                    "Failed to process messages for sender",
-                    error=str(e),
-                    sender_id=sender_id,
-                    message_count=len(messages),
-                )
+        messages_by_sender, failed_record_ids = group_messages_by_sender(records)
+
+        # Store all senders' messages together
+        failed_senders = process_messages(messages_by_sender)
+
+        # Report unparseable records and every record of a failed sender so
+        # SQS redelivers only those
+        batch_item_failures = [
+            {"itemIdentifier": record_id} for record_id in failed_record_ids
+        ]
+        batch_item_failures.extend(
+            {"itemIdentifier": message["record_id"]}
+            for sender_id in failed_senders
+            for message in messages_by_sender[sender_id]
+        )
 
         logger.info(
             "Batch processing complete",
             total_processed=len(records),
             sender_count=len(messages_by_sender),
+            failed_count=len(batch_item_failures),
         )
         return {
             "statusCode": 200,
-            "body": json.dumps(
+            "body": orjson.dumps(
                 {
                     "message": "Batch processing complete",
                     "total_processed": len(records),
                     "sender_count": len(messages_by_sender),
+                    "failed_count": len(batch_item_failures),
                 }
-            ),
+            ).decode(),
+            "batchItemFailures": batch_item_failures,
         }
 
     except Exception as e:
@@ -217,5 +220,11 @@ def queue_handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         )
         return {
             "statusCode": 500,
-            "body": json.dumps({"error": "Internal server error", "message": str(e)}),
+            "body": orjson.dumps(
+                {"error": "Internal server error", "message": str(e)}
+            ).decode(),
+            "batchItemFailures": [
+                {"itemIdentifier": record["messageId"]}
+                for record in event.get("Records", [])
+            ],
         }
@@ -0,0 +1,68 @@
+"""
+One-off migration that writes status_created_at on existing session items so
+SenderStatusIndex can serve every active-session lookup.
+
+Run from the repository root when SenderStatusIndex is added to an existing
+sessions table (the deploy workflow does this):
+
+    python scripts/backfill_status_created_at.py [table_name]
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import boto3  # noqa: E402
+from handlers.session_store import (  # noqa: E402
+    build_status_created_at,
+    repair_status_created_at,
+)
+from logger_setup import get_logger  # noqa: E402
+
+logger = get_logger("backfill")
+
+
+def backfill(table_name: str) -> int:
+    """
+    Scan the sessions table and rewrite status_created_at wherever it is
+    missing or no longer matches the item's status and created_at.
+
+    Args:
+        table_name: Name of the sessions table
+
+    Returns:
+        Number of items updated
+    """
+    table = boto3.resource("dynamodb").Table(table_name)
+    scan_kwargs = {
+        "FilterExpression": "attribute_exists(#status) AND attribute_exists(created_at)",
+        "ProjectionExpression": "session_id, #status, created_at, status_created_at",
+        "ExpressionAttributeNames": {"#status": "status"},
+    }
+    scanned = 0
+    repaired = 0
+
+    while True:
+        response = table.scan(**scan_kwargs)
+        for item in response["Items"]:
+            scanned += 1
+            if item.get("status_created_at") != build_status_created_at(item):
+                if repair_status_created_at(table, item):
+                    repaired += 1
+
+        if "LastEvaluatedKey" not in response:
+            break
+        scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    logger.info(
+        "Backfilled status_created_at",
+        table_name=table_name,
+        scanned_count=scanned,
+        repaired_count=repaired,
+    )
+    return repaired
+
+
+if __name__ == "__main__":
+    backfill(sys.argv[1] if len(sys.argv) > 1 else "sessions")